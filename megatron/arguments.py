@@ -432,7 +432,8 @@ def validate_args(args, defaults={}):
     args.compression_training = False
 
     # FlashAttention
-    args.use_flash_attn = args.use_flash_attn_v1 or args.use_flash_attn_triton or args.use_flash_attn_v2 or args.use_flash_attn_builder
+    args.use_flash_attn = args.use_flash_attn_v1 or args.use_flash_attn_triton or args.use_flash_attn_v2 or args.use_flash_attn_builder \
+        or args.use_flash_attn_torch
 
     # AML
     if args.aml_data_download_path is not None:
@@ -909,6 +910,18 @@ def _add_training_args(parser):
     group.add_argument('--no-bias-dropout-fusion', action='store_false',
                        help='Disable bias and dropout fusion.',
                        dest='bias_dropout_fusion')
+    group.add_argument('--compile-pre-process', action='store_true',
+                       help='Compile the embedding of the FlexTrain pre-process '
+                       'with torch.compile.')
+    group.add_argument('--compile-post-process', action='store_true',
+                       help='Compile the final layernorm and the language model '
+                       'head of the FlexTrain post-process with torch.compile.')
+    group.add_argument('--compile-kd-loss', action='store_true',
+                       help='Compile the knowledge distillation KL divergence '
+                       'with torch.compile.')
+    group.add_argument('--compile-loss', action='store_true',
+                       help='Compile the masked mean of the language model '
+                       'loss with torch.compile.')
     group.add_argument('--disable-moe-token-dropping', action='store_false',
                        help='Disable MoE expert token dropping.',
                        dest='moe_token_dropping')
@@ -936,6 +949,9 @@ def _add_training_args(parser):
                        help='use FlashAttention implementation of attention using Triton.')
     group.add_argument('--use-flash-attn-builder', action='store_true',
                        help='use FlashAttention op builder.')
+    group.add_argument('--use-flash-attn-torch', action='store_true',
+                       help='use PyTorch scaled_dot_product_attention implementation of attention, '
+                       'which dispatches to the FlashAttention kernel when available.')
     group.add_argument('--disable-bias-linear', action='store_false',
                        help='Disable bias in the linear layers',
                        dest='add_bias_linear')
@@ -1004,6 +1020,12 @@ def _add_initialization_args(parser):
     group.add_argument('--data-parallel-random-init', action='store_true',
                        help='Enable random initialization of params '
                        'across data parallel ranks')
+    group.add_argument('--deterministic', action='store_true', default=None,
+                       help='Use deterministic cuDNN algorithms and full fp32 '
+                       'matmul precision. Entry points that default it to '
+                       'False (e.g. GPT pretraining) enable cuDNN autotuning '
+                       'and TF32 instead; otherwise the PyTorch backend '
+                       'settings are left untouched.')
     group.add_argument('--init-method-std', type=float, default=0.02,
                        help='Standard deviation of the zero mean normal '
                        'distribution used for weight initialization.')
@@ -15,6 +15,11 @@ from deepspeed.accelerator import get_accelerator
 
 _MAX_DATA_DIM = 5
 
+# Pinned host buffers (one per data type) reused to stage host data before
+# the host-to-device copy, and the event recorded after the last such copy.
+_PINNED_BUFFERS = {}
+_PINNED_BUFFER_EVENT = None
+
 
 def _check_data_types(keys, data, target_dtype):
     """Check that all the keys have the same target data type."""
@@ -72,6 +77,36 @@ def _build_key_size_numel_dictionaries(keys, data, group=None, rank=-1, src_rank
     return key_size, key_numel, total_numel
 
 
+def _get_pinned_buffer(numel, datatype):
+    """Return a pinned host buffer of numel elements, once the previous
+    copy out of the staging buffers has completed."""
+    if _PINNED_BUFFER_EVENT is not None:
+        _PINNED_BUFFER_EVENT.synchronize()
+    buffer = _PINNED_BUFFERS.get(datatype)
+    if buffer is None or buffer.numel() < numel:
+        buffer = get_accelerator().pin_memory(torch.empty(numel, dtype=datatype))
+        _PINNED_BUFFERS[datatype] = buffer
+    return buffer[:numel]
+
+
+def _flatten_to_device(keys, data, datatype, total_numel):
+    """Flatten the data associated with the keys into a device tensor."""
+    if any(data[key].device.type != 'cpu' for key in keys):
+        return torch.cat(
+            [data[key].contiguous().view(-1) for key in keys], dim=0).to(get_accelerator().device_name())
+
+    # Host data is staged through a reused pinned buffer, so that the copy
+    # to the device is asynchronous.
+    global _PINNED_BUFFER_EVENT
+    staging = _get_pinned_buffer(int(total_numel), datatype)
+    torch.cat([data[key].contiguous().view(-1) for key in keys], dim=0, out=staging)
+    flatten_data = staging.to(get_accelerator().current_device_name(), non_blocking=True)
+    if _PINNED_BUFFER_EVENT is None:
+        _PINNED_BUFFER_EVENT = get_accelerator().Event()
+    _PINNED_BUFFER_EVENT.record()
+    return flatten_data
+
+
 def broadcast_data(keys, data, datatype):
     """Broadcast data from rank zero of each model parallel group to the
     members of the same model parallel group.
@@ -101,8 +136,7 @@ def broadcast_data(keys, data, datatype):
         # Check that all keys have the same data type.
         _check_data_types(keys, data, datatype)
         # Flatten the data associated with the keys
-        flatten_data = torch.cat(
-            [data[key].contiguous().view(-1) for key in keys], dim=0).to(get_accelerator().device_name())
+        flatten_data = _flatten_to_device(keys, data, datatype, total_numel)
     else:
         flatten_data = torch.empty(total_numel,
                                    device=get_accelerator().current_device_name(),
@@ -362,6 +362,30 @@ def test_allmasked_softmax_backward():
             assert error < 1e-3
 
 
+def test_causal_torch_softmax_without_mask():
+    batch = 2
+    attn = 16
+    softmax = FusedScaleMaskSoftmax(
+        input_in_fp16=False,
+        input_in_bf16=False,
+        attn_mask_type=AttnMaskType.causal,
+        scaled_masked_softmax_fusion=False,
+        mask_func=attention_mask_func,
+        softmax_in_fp32=True,
+        scale=None,
+    )
+    # sq != sk covers the offset of the queries in the keys (kv cache), the
+    # shorter klen is sliced from the mask built for the longest one
+    for qlen, klen in [(128, 128), (32, 128), (1, 128), (64, 64), (16, 64)]:
+        inputs = torch.normal(0, 2, (batch, attn, qlen, klen), dtype=torch.float32, device='cuda:0')
+        masks = torch.tril(torch.ones((klen, klen), dtype=torch.bool, device='cuda:0'))[-qlen:]
+        masks = masks.logical_not().view(1, 1, qlen, klen)
+        softmax_results_torch = forward_torch_softmax(inputs, masks, 1.0)
+        softmax_results = softmax.forward_torch_softmax(inputs.clone(), None)
+        error = (softmax_results_torch - softmax_results).abs().max()
+        assert error < 1e-6
+
+
 if __name__ == "__main__":
     try:
         from transformers import BertTokenizer, GPT2Tokenizer
@@ -382,6 +406,7 @@ if __name__ == "__main__":
     test_masked_softmax_backward()
     test_allmasked_softmax_forward()
     test_allmasked_softmax_backward()
+    test_causal_torch_softmax_without_mask()
     test_load_fused_kernels()
     test_fused_softmax()
     test_fused_upper_triangle_mask_softmax()
@@ -73,6 +73,8 @@ def initialize_megatron(extra_args_provider=None, args_defaults={},
         if args.rank == 0:
             print('> setting random seeds to {} ...'.format(args.seed))
         _set_random_seed(args.seed, args.data_parallel_random_init)
+        if args.deterministic is not None:
+            _set_backend_options(args.deterministic)
 
     args = get_args()
     if  args.lazy_mpu_init:
@@ -300,6 +302,14 @@ def _set_random_seed(seed_, data_parallel_random_init=False):
         raise ValueError('Seed ({}) should be a positive integer.'.format(seed))
 
 
+def _set_backend_options(deterministic=False):
+    """Trade reproducibility for kernel selection speed unless deterministic."""
+    torch.backends.cudnn.deterministic = deterministic
+    torch.backends.cudnn.benchmark = not deterministic
+    torch.backends.cudnn.allow_tf32 = not deterministic
+    torch.set_float32_matmul_precision('highest' if deterministic else 'high')
+
+
 def write_args_to_tensorboard():
     """Write arguments to tensorboard."""
     args = get_args()
@@ -6,6 +6,22 @@ import torch.nn as nn
 from megatron.model.enums import AttnMaskType
 
 
+# Largest causal mask built so far, shared by all layers
+_CAUSAL_MASK = None
+
+
+def _causal_mask(sq, sk, device):
+    """Causal mask of shape [1, 1, sq, sk] (True means masked out), sliced
+    from the largest mask seen so far. Query i sits at key position
+    sk - sq + i."""
+    global _CAUSAL_MASK
+    if _CAUSAL_MASK is None or _CAUSAL_MASK.size(-1) < sk \
+            or _CAUSAL_MASK.device != device:
+        _CAUSAL_MASK = torch.ones((1, 1, sk, sk), dtype=torch.bool,
+                                  device=device).triu_(1)
+    return _CAUSAL_MASK[:, :, sk - sq:sk, :sk]
+
+
 class ScaledUpperTriangMaskedSoftmax(torch.autograd.Function):
     """
     Fused operation which performs following three operations in sequence
@@ -195,6 +211,10 @@ class FusedScaleMaskSoftmax(nn.Module):
 
         if self.scale is not None:
             input = input * self.scale
+        if mask is None and self.attn_mask_type.value == AttnMaskType.causal.value:
+            # The causal mask is not materialized by the caller, use the one
+            # shared across layers instead of building one per layer.
+            mask = _causal_mask(input.size(2), input.size(3), input.device)
         mask_output = self.mask_func(input, mask) if mask is not None else input
         probs = torch.nn.Softmax(dim=-1)(mask_output)
 
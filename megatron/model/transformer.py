@@ -504,6 +504,59 @@ class FlashSelfAttentionTriton(torch.nn.Module):
         output = rearrange(output, 'b s h d -> s b (h d)').contiguous()
         return output
 
+class FlashSelfAttentionTorch(torch.nn.Module):
+    """Implement the scaled dot product attention with softmax using
+    torch.nn.functional.scaled_dot_product_attention, which dispatches to the
+    FlashAttention kernel and applies the causal mask inside the fused kernel.
+    Arguments
+    ---------
+        softmax_scale: The temperature to use for the softmax attention.
+                      (default: 1/sqrt(d_keys) where d_keys is computed at
+                      runtime)
+        attention_dropout: The dropout rate to apply to the attention
+                           (default: 0.0)
+    """
+    def __init__(self, causal=False, softmax_scale=None, attention_dropout=0.0,
+                 device=None, dtype=None):
+        super().__init__()
+        self.causal = causal
+        self.softmax_scale = softmax_scale
+        self.dropout_p = attention_dropout
+
+    def forward(self, q, k, v):
+        """Implements the multihead softmax attention.
+        Arguments
+        ---------
+            q, k, v: The tensor containing the query, key, and value. (B, S, H, D)
+        """
+
+        assert all((i.dtype in [torch.float16, torch.bfloat16] for i in (q,k,v)))
+
+        seqlen_q, seqlen_k = q.shape[1], k.shape[1]
+        if self.training:
+            # during training q,k,v always have same seqlen
+            assert seqlen_k == seqlen_q
+            is_causal = self.causal
+            dropout_p = self.dropout_p
+        else:
+            # only on first autoregressive step q,k,v have same seqlen
+            is_causal = seqlen_q == seqlen_k
+            dropout_p = 0
+
+        if self.softmax_scale is not None:
+            # The `scale` argument of SDPA needs torch>=2.1; fold the custom
+            # scale into q on top of the default 1/sqrt(d) instead.
+            q = q * (self.softmax_scale * math.sqrt(q.size(-1)))
+
+        # [b, s, h, d] -> [b, h, s, d]
+        q, k, v = [x.transpose(1, 2) for x in (q, k, v)]
+        output = F.scaled_dot_product_attention(
+            q, k, v, dropout_p=dropout_p, is_causal=is_causal
+        )
+
+        # [b, h, s, d] -> [b, s, h, d]
+        return output.transpose(1, 2)
+
 class ParallelAttention(MegatronModule):
     """Parallel self-attention layer abstract class.
 
@@ -526,10 +579,11 @@ class ParallelAttention(MegatronModule):
         self.use_gqa = (self.num_attention_heads != self.num_key_value_heads)
 
         self.use_flash_attn = (args.use_flash_attn_v1 or args.use_flash_attn_triton or args.use_flash_attn_v2 or \
-            args.use_flash_attn_builder) \
+            args.use_flash_attn_builder or args.use_flash_attn_torch) \
             and attention_type == AttnType.self_attn \
             and self.attn_mask_type == AttnMaskType.causal
         self.use_flash_attn_triton = args.use_flash_attn_triton
+        self.use_flash_attn_torch = args.use_flash_attn_torch
         if self.use_flash_attn:
             global flash_attn_builder
             try:
@@ -545,6 +599,8 @@ class ParallelAttention(MegatronModule):
                 assert flash_attn_func != None, "Cannot import FlashAttention triton "
             if args.use_flash_attn_builder:
                 assert flash_attn_builder != None, "Cannot find FlashAttention op builder "
+            if args.use_flash_attn_torch:
+                assert hasattr(F, 'scaled_dot_product_attention'), "Cannot find PyTorch scaled_dot_product_attention "
 
             assert attention_type == AttnType.self_attn, ('FlashAttention code path only supports '
                                                           'self-attention for now')
@@ -606,6 +662,8 @@ class ParallelAttention(MegatronModule):
         # Currently FlashAttention only works with causal mask
         if self.use_flash_attn_triton:
             local_attn = FlashSelfAttentionTriton(causal=True, attention_dropout=args.attention_dropout)
+        elif self.use_flash_attn_torch:
+            local_attn = FlashSelfAttentionTorch(causal=True, attention_dropout=config.attention_dropout)
         elif self.use_flash_attn:
             local_attn = FlashSelfAttention(causal=True, attention_dropout=config.attention_dropout)
         else:
@@ -619,7 +677,7 @@ class ParallelAttention(MegatronModule):
             self.dist_attn = DistributedAttention(
                 local_attn, 
                 parallel_state.get_sequence_parallel_group(), 
-                gather_idx=1 if args.use_flash_attn_v1 or args.use_flash_attn_v2 else 0) 
+                gather_idx=1 if args.use_flash_attn_v1 or args.use_flash_attn_v2 or args.use_flash_attn_torch else 0) 
             # flash_attn_cuda assumes [b, s, nh, hd] layout, we need to make sure all2all gathers into the correct sequence dimension.
         else:
             if self.use_flash_attn:
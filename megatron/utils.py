@@ -164,8 +164,13 @@ def get_ltor_masks_and_position_ids(data,
                                     reset_position_ids,
                                     reset_attention_mask,
                                     eod_mask_loss,
-                                    skip_mask=False):
-    """Build masks and position id for left to right model."""
+                                    skip_mask=False,
+                                    position_ids=None):
+    """Build masks and position id for left to right model.
+
+    If `position_ids` is given (of shape [1, seq_length]) it is used instead
+    of building them, which is only valid when `reset_position_ids` is False.
+    """
 
     # Extract batch size and sequence length.
     micro_batch_size, seq_length = data.size()
@@ -187,9 +192,12 @@ def get_ltor_masks_and_position_ids(data,
         loss_mask[data == eod_token] = 0.0
 
     # Position ids.
-    position_ids = torch.arange(seq_length, dtype=torch.long,
-                                device=data.device)
-    position_ids = position_ids.unsqueeze(0).expand_as(data)
+    if position_ids is None:
+        position_ids = torch.arange(seq_length, dtype=torch.long,
+                                    device=data.device).unsqueeze(0)
+    else:
+        assert not reset_position_ids
+    position_ids = position_ids.expand_as(data)
     # We need to clone as the ids will be modifed based on batch index.
     if reset_position_ids:
         position_ids = position_ids.clone()
@@ -4,7 +4,7 @@
 
 import torch
 import math
-from functools import partial
+from functools import lru_cache, partial
 from megatron import get_args
 from megatron import print_rank_0
 from megatron import get_timers
@@ -14,6 +14,7 @@ from megatron.core.enums import ModelType
 from megatron.core.pipeline_parallel.schedules import get_curr_data_iterator
 from megatron.data.gpt_dataset import build_train_valid_test_datasets
 from megatron.model import GPTModel, GPTModelPipe
+from megatron.model.gpt_model import post_language_model_processing
 from megatron.training import pretrain
 from megatron.utils import get_ltor_masks_and_position_ids
 from megatron.utils import average_losses_across_data_parallel_group, update_rotary_pos_emb
@@ -28,33 +29,48 @@ from deepspeed.sequence.fpdt_layer import FPDT_InputConstruct
 import os
 import subprocess
 
-from torch import nn
 import torch.nn.functional as F
 
 
 # Link to target GPT model
 _GPT_MODEL: GPTModel = None
 
+# Language model head inputs, bound once the model is built so that
+# post_process_func does not dereference them on every micro-batch
+_WORD_EMBEDDINGS_WEIGHT: torch.nn.Parameter = None
+_PARALLEL_OUTPUT: bool = None
+_FP16_LM_CROSS_ENTROPY: bool = None
+
 
 def get_batch_func():
     """ FlexTrain get_batch function """
 
     # Get the data iterator and original batch data
     data_iterator = get_curr_data_iterator()
-    batch_data = get_batch(data_iterator)
+    tokens, labels, loss_mask, attention_mask, position_ids = \
+        get_batch(data_iterator)
 
     # Model inputs: input_ids, position_ids, attention_mask
-    model_inputs = (batch_data[0], batch_data[4], batch_data[3])
+    model_inputs = (tokens, position_ids, attention_mask)
 
     # Post-process inputs: labels
-    post_inputs = (batch_data[1], )
+    post_inputs = (labels, )
 
     # Loss function inputs: loss_mask
-    loss_inputs = (batch_data[2], )
+    loss_inputs = (loss_mask, )
 
     return model_inputs, post_inputs, loss_inputs
 
 
+def _pre_process(input_ids, position_ids):
+    """ Embedding layer """
+    return _GPT_MODEL.language_model.embedding(input_ids, position_ids)
+
+
+# _pre_process, or its compiled version under --compile-pre-process
+_PRE_PROCESS = _pre_process
+
+
 def pre_process_func(model_inputs):
     """ FlexTrain pre_process function """
 
@@ -64,7 +80,7 @@ def pre_process_func(model_inputs):
     # Please refer to the original forward function for the following code
 
     # Embedding layer
-    encoder_input = _GPT_MODEL.language_model.embedding(input_ids, position_ids)
+    encoder_input = _PRE_PROCESS(input_ids, position_ids)
 
     # Viewless tensor.
     from megatron.core.utils import make_viewless_tensor
@@ -85,36 +101,26 @@ def get_layer(index):
 def custom_forward(start, end):
     """ FlexTrain custom forward function """
 
+    # Resolve the layers once instead of on every forward
+    layers = [get_layer(index) for index in range(start, end)]
+
     def forward(x, moe_losses, attention_mask):
-        for index in range(start, end):
-            layer = get_layer(index)
+        for layer in layers:
             output = layer(x, attention_mask)
+            # Layers without a MoE loss contribute nothing, an empty list
+            # reduces to a zero MoE loss in flextrain_loss_func.
             if isinstance(output, tuple):
                 x, moe_loss = output
+                moe_losses.append(moe_loss)
             else:
                 x = output
-                moe_loss = torch.tensor(
-                    0.0,
-                    device=x.device,
-                    dtype=x.dtype,
-                    requires_grad=True
-                )
-            moe_losses.append(moe_loss)
         return (x, moe_losses)
 
     return forward
 
 
-def post_process_func(passed_down, post_inputs):
-    """ FlexTrain post_process function """
-
-    # passed_down is the hidden_states and moe_losses
-    assert len(passed_down) == 2
-    hidden_states, moe_losses = passed_down
-
-    # post_inputs is the labels
-    assert len(post_inputs) == 1
-    labels = post_inputs[0]
+def _post_process(hidden_states, labels):
+    """ Final layer norm followed by the language model head """
 
     # Final layer norm
     hidden_states = _GPT_MODEL.language_model.encoder.final_layernorm(
@@ -122,14 +128,30 @@ def post_process_func(passed_down, post_inputs):
     )
 
     # Conduct language model post-processing
-    from megatron.model.gpt_model import post_language_model_processing
-    lm_output = post_language_model_processing(
+    return post_language_model_processing(
         hidden_states, labels,
-        _GPT_MODEL.language_model.embedding.word_embeddings.weight,
-        _GPT_MODEL.parallel_output,
-        _GPT_MODEL.fp16_lm_cross_entropy
+        _WORD_EMBEDDINGS_WEIGHT,
+        _PARALLEL_OUTPUT,
+        _FP16_LM_CROSS_ENTROPY
     )
 
+
+# _post_process, or its compiled version under --compile-post-process
+_POST_PROCESS = _post_process
+
+
+def post_process_func(passed_down, post_inputs):
+    """ FlexTrain post_process function """
+
+    # passed_down is the hidden_states and moe_losses
+    hidden_states, moe_losses = passed_down
+
+    # post_inputs is the labels
+    labels, = post_inputs
+
+    # Please refer to the original forward function for the following code
+    lm_output = _POST_PROCESS(hidden_states, labels)
+
     return lm_output, moe_losses
 
 
@@ -142,17 +164,18 @@ def flextrain_loss_func(model_output, loss_inputs):
     output_tensor, other_losses = model_output
 
     # Model output kwargs: output_tensor
-    moe_losses = []
-    for moe_loss in other_losses:
-        if moe_loss is not None:
-            moe_losses.append(moe_loss)
-    moe_loss = sum(moe_losses) * args.moe_loss_coeff
+    # custom_forward only collects MoE loss tensors, no None entries
+    if other_losses:
+        # Single reduction kernel instead of a chain of scalar adds
+        moe_loss = torch.stack(other_losses).sum().mul_(args.moe_loss_coeff)
+    else:
+        moe_loss = 0.0
 
     # Loss function kwargs: mos_loss (mos not supported yet, a placeholder)
     mos_loss = 0.0
 
     # Loss inputs: loss_mask
-    loss_mask = loss_inputs[0]
+    loss_mask, = loss_inputs
 
     # Return the loss
     return loss_func(loss_mask, moe_loss, mos_loss, output_tensor)
@@ -189,6 +212,18 @@ def flextrain_model_provider(pre_process=True, post_process=True):
         )
         global _GPT_MODEL
         _GPT_MODEL = model
+    global _WORD_EMBEDDINGS_WEIGHT, _PARALLEL_OUTPUT, _FP16_LM_CROSS_ENTROPY
+    _WORD_EMBEDDINGS_WEIGHT = model.language_model.embedding.word_embeddings.weight
+    _PARALLEL_OUTPUT = model.parallel_output
+    _FP16_LM_CROSS_ENTROPY = model.fp16_lm_cross_entropy
+    if args.compile_pre_process:
+        # Let inductor fuse the word and position embedding lookups
+        global _PRE_PROCESS
+        _PRE_PROCESS = torch.compile(_pre_process, dynamic=False)
+    if args.compile_post_process:
+        # Let inductor fuse the layernorm into the logits computation
+        global _POST_PROCESS
+        _POST_PROCESS = torch.compile(_post_process, dynamic=False)
     set_llm_func(
         get_layer=get_layer,
         get_batch=get_batch_func,
@@ -234,22 +269,11 @@ def model_provider(pre_process=True, post_process=True):
             # We need to call model.set_batch_fn after deepspeed.initialize
             model._megatron_batch_fn = get_batch_pipe
 
-            # Predompute the attention mask and store it in args. This avoids having to
-            # pipeline it as an activation during training. The mask is constant, and thus
-            # we can reuse it.
-            attention_mask = torch.tril(torch.ones(
-                (1, args.seq_length, args.seq_length), device=get_accelerator().current_device_name())).view(
-                    1, 1, args.seq_length, args.seq_length)
-
-            # Convert attention mask to binary:
-            attention_mask = (attention_mask < 0.5)
-            if args.fp16:
-                attention_mask = attention_mask.half()
-            elif args.bf16:
-                attention_mask = attention_mask.bfloat16()
-
-            # Attention mask must be bool.
-            args.attn_mask = attention_mask.to(torch.bool)
+            # The attention mask is static and causal, so it is neither pipelined as an
+            # activation nor kept in memory. FlashAttention and the fused upper triangular
+            # softmax apply it inside the kernel, and the unfused softmax fallback builds
+            # it for the current call only (see FusedScaleMaskSoftmax).
+            args.attn_mask = None
 
             # For prertaining, since sequence length is fixed, cache rotary embedding in args, to avoid communicating around
             if args.use_rotary_position_embeddings:
@@ -267,36 +291,104 @@ def model_provider(pre_process=True, post_process=True):
     return model
 
 
+# maxsize=1: curriculum learning changes the batch shape every few steps,
+# so only the tensors for the current shape are kept on the device.
+@lru_cache(maxsize=1)
+def _cached_position_ids(seq_length, device):
+    """ Position ids of shape [1, seq_length], shared across batches """
+    return torch.arange(seq_length, dtype=torch.long, device=device).unsqueeze(0)
+
+
+def _get_position_ids(tokens):
+    """ Cached position ids for tokens, None if they must be rebuilt """
+    if get_args().reset_position_ids:
+        return None
+    return _cached_position_ids(tokens.size(1), tokens.device)
+
+
+@lru_cache(maxsize=1)
+def _cached_loss_mask(size, device):
+    """ All-ones loss mask, shared across batches """
+    return torch.ones(size, dtype=torch.float, device=device)
+
+
+def _get_masks_and_position_ids(tokens):
+    """ Attention mask, loss mask and position ids for tokens """
+    args = get_args()
+    skip_mask = args.use_flash_attn or args.use_flash_attn_triton
+
+    # Without a mask to build and without any EOD handling, none of the
+    # outputs depend on the token values, so the cached tensors are reused.
+    if skip_mask and not (args.reset_position_ids or
+                          args.reset_attention_mask or
+                          args.eod_mask_loss):
+        loss_mask = _cached_loss_mask(tokens.size(), tokens.device)
+        position_ids = _get_position_ids(tokens).expand_as(tokens)
+        return None, loss_mask, position_ids
+
+    return get_ltor_masks_and_position_ids(
+        tokens,
+        get_tokenizer().eod,
+        args.reset_position_ids,
+        args.reset_attention_mask,
+        args.eod_mask_loss,
+        skip_mask,
+        _get_position_ids(tokens))
+
+
+# Side stream used to prepare batches off the compute stream
+_BATCH_STREAM = None
+
+
 def get_batch(data_iterator):
     """Generate a batch"""
+    global _BATCH_STREAM
+    if _BATCH_STREAM is None:
+        _BATCH_STREAM = get_accelerator().Stream()
+
+    # Broadcast and unpack on the side stream, so that the host-device copies
+    # do not queue up behind the kernels still pending on the compute stream
+    # (e.g. the backward pass of the previous micro-batch).
+    compute_stream = get_accelerator().current_stream()
+    with get_accelerator().stream(_BATCH_STREAM):
+        batch = _get_batch(data_iterator)
+
+    # The compute stream only waits once it consumes the batch.
+    compute_stream.wait_stream(_BATCH_STREAM)
+    for tensor in batch:
+        if torch.is_tensor(tensor):
+            tensor.record_stream(compute_stream)
+
+    return batch
+
+
+def _get_batch(data_iterator):
+    """Generate a batch on the current stream"""
     args = get_args()
-    tokenizer = get_tokenizer()
 
-    # Items and their type.
+    # Items and their type. Token ids fit in int32, which halves the
+    # broadcast volume and the embedding index bandwidth.
     keys = ['text']
-    datatype = torch.int64
+    datatype = torch.int32
 
     # Broadcast data.
     if data_iterator is not None:
         data = next(data_iterator)
+        data = {key: data[key].to(datatype) for key in keys}
     else:
         data = None
     data_b = tensor_parallel.broadcast_data(keys, data, datatype)
 
     # Unpack.
-    tokens_ = data_b['text'].long()
-    labels = tokens_[:, 1:].contiguous()
-    tokens = tokens_[:, :-1].contiguous()
+    # The tokens slice is left strided, the embedding accepts int32 indices as
+    # is. Labels are widened to int64, which the cross-entropy losses (e.g.
+    # F.nll_loss under DS sequence parallel) require for their targets.
+    tokens_ = data_b['text']
+    labels = tokens_[:, 1:].long()
+    tokens = tokens_[:, :-1]
 
     # Get the masks and postition ids.
-    skip_mask = args.use_flash_attn or args.use_flash_attn_triton
-    attention_mask, loss_mask, position_ids = get_ltor_masks_and_position_ids(
-        tokens,
-        tokenizer.eod,
-        args.reset_position_ids,
-        args.reset_attention_mask,
-        args.eod_mask_loss,
-        skip_mask)
+    attention_mask, loss_mask, position_ids = _get_masks_and_position_ids(tokens)
 
     # For DS's sequence parallel
     seq_parallel_world_size = mpu.get_sequence_parallel_world_size()
@@ -331,20 +423,28 @@ def data_post_process(data, data_sampler_state_dict):
             args.data_efficiency_curriculum_learning_seqlen_type = 'seqlen_truncate'
             current_seqlen = data_sampler_state_dict['current_difficulties']['seqlen_truncate']
             if current_seqlen < args.seq_length:
-                data['text'] = data['text'][:, :(current_seqlen+1)].contiguous()
+                # broadcast_data flattens the slice, no need to copy it here
+                data['text'] = data['text'][:, :(current_seqlen+1)]
         elif 'seqlen_reshape' in data_sampler_state_dict['current_difficulties']:
             args.data_efficiency_curriculum_learning_seqlen_type = 'seqlen_reshape'
             current_seqlen = data_sampler_state_dict['current_difficulties']['seqlen_reshape']
             if current_seqlen < args.seq_length:
                 orig_num_token = torch.numel(data['text'])
                 reshape_len = (data['text'].size()[1] // (current_seqlen+1)) * (current_seqlen+1)
-                data['text'] = torch.cat((data['text'][:, :reshape_len].contiguous().view(-1, current_seqlen+1),
-                    data['text'][:, -(current_seqlen+1):]), 0).contiguous()
+                reshaped = data['text'][:, :reshape_len].reshape(-1, current_seqlen+1)
                 num_row = math.ceil(orig_num_token / (current_seqlen+1))
-                num_row = min(num_row, data['text'].size()[0])
+                num_row = min(num_row, reshaped.size()[0] + data['text'].size()[0])
                 if num_row > 1 and num_row % 2 != 0:
                     num_row -= 1
-                data['text'] = data['text'][:num_row, :].contiguous()
+                # The tail of each sample follows the reshaped rows. Only copy
+                # the tail rows that are kept, instead of concatenating all of
+                # them and slicing afterwards.
+                num_tail_row = num_row - reshaped.size()[0]
+                if num_tail_row > 0:
+                    data['text'] = torch.cat((reshaped,
+                        data['text'][:num_tail_row, -(current_seqlen+1):]), 0)
+                else:
+                    data['text'] = reshaped[:num_row]
         else:
             args.data_efficiency_curriculum_learning_seqlen_type = None
     return data
@@ -352,44 +452,74 @@ def data_post_process(data, data_sampler_state_dict):
 def get_batch_pipe(data):
     """Modification of `get_batch` to work on `next(data_iterator)` instead of `data_iterator`"""
     args = get_args()
-    tokenizer = get_tokenizer()
 
-    # Items and their type.
+    # Items and their type. Token ids fit in int32, which halves the
+    # broadcast volume and the embedding index bandwidth.
     keys = ['text']
-    datatype = torch.int64
+    datatype = torch.int32
 
     # Broadcast data.
+    if data is not None:
+        data = {key: data[key].to(datatype) for key in keys}
     data_b = tensor_parallel.broadcast_data(keys, data, datatype)
 
     # Unpack.
-    tokens_ = data_b['text'].long()
-    labels = tokens_[:, 1:].contiguous()
-    tokens = tokens_[:, :-1].contiguous()
+    # The tokens slice is left strided, the embedding accepts int32 indices as
+    # is. Labels are widened to int64, which the cross-entropy losses (e.g.
+    # F.nll_loss under DS sequence parallel) require for their targets.
+    tokens_ = data_b['text']
+    labels = tokens_[:, 1:].long()
+    tokens = tokens_[:, :-1]
 
     # Get the masks and postition ids.
-    attention_mask, loss_mask, position_ids = get_ltor_masks_and_position_ids(
-        tokens,
-        tokenizer.eod,
-        args.reset_position_ids,
-        args.reset_attention_mask,
-        args.eod_mask_loss)
+    attention_mask, loss_mask, position_ids = _get_masks_and_position_ids(tokens)
     if args.curriculum_learning_legacy and args.curriculum_seqlen < tokens.size()[1]:
         # seqlen-based curriculum learning
         # tokens, position_ids, labels, loss_mask have size [batch size, seqlen]
-        tokens = tokens[:, :args.curriculum_seqlen].contiguous()
-        position_ids = position_ids[:, :args.curriculum_seqlen].contiguous()
+        tokens = tokens[:, :args.curriculum_seqlen]
+        position_ids = position_ids[:, :args.curriculum_seqlen]
         if labels is not None:
-            labels = labels[:, :args.curriculum_seqlen].contiguous()
+            labels = labels[:, :args.curriculum_seqlen]
+        # loss_mask is flattened with view() in loss_func
         loss_mask = loss_mask[:, :args.curriculum_seqlen].contiguous()
 
+    # The pipeline engine only loads tensors, and EmbeddingPipe never reads the
+    # mask (it uses args.attn_mask), so drop it when FlashAttention skips it.
+    if attention_mask is None:
+        return (tokens, position_ids), (labels, loss_mask)
     return (tokens, position_ids, attention_mask), (labels, loss_mask)
 
 
+def _masked_mean(losses: torch.Tensor, loss_mask: torch.Tensor) -> torch.Tensor:
+    """Mean of the losses over the positions kept by loss_mask.
+
+    Scripted by default, which fuses the casts and the multiply only. Under
+    --compile-loss, inductor also fuses the two reductions and the divide.
+    """
+    losses = losses.float().view(-1)
+    loss_mask = loss_mask.view(-1).float()
+    return torch.sum(losses * loss_mask) / loss_mask.sum()
+
+
+# Scripted _masked_mean, or its compiled version under --compile-loss
+_MASKED_MEAN = None
+
+
+def _get_masked_mean(args):
+    """ Bind _MASKED_MEAN on first use """
+    global _MASKED_MEAN
+    if _MASKED_MEAN is None:
+        if args.compile_loss:
+            # Sequence length changes with curriculum learning
+            _MASKED_MEAN = torch.compile(_masked_mean, dynamic=True)
+        else:
+            _MASKED_MEAN = torch.jit.script(_masked_mean)
+    return _MASKED_MEAN
+
+
 def loss_func(loss_mask, moe_loss, mos_loss, output_tensor):
     args = get_args()
-    losses = output_tensor.float()
-    loss_mask = loss_mask.view(-1).float()
-    loss = torch.sum(losses.view(-1) * loss_mask) / loss_mask.sum()
+    loss = _get_masked_mean(args)(output_tensor, loss_mask)
 
     # Reduce loss for logging.
     averaged_loss = average_losses_across_data_parallel_group([loss])
@@ -408,6 +538,31 @@ def loss_func(loss_mask, moe_loss, mos_loss, output_tensor):
             loss = loss + moe_loss
             return loss, {'lm loss': averaged_loss[0], 'moe loss': moe_loss}
 
+def _kd_kl_div(stu_output, tea_output, kd_temp):
+    """KL divergence between the temperature-scaled teacher and student distributions.
+
+    Both sides stay in log space (log_target=True). Under --compile-kd-loss,
+    inductor fuses the two log-softmaxes, the divergence and the reduction.
+    """
+    student_logits = F.log_softmax(stu_output / kd_temp, dim=2)
+    tea_logits = F.log_softmax(tea_output / kd_temp, dim=2)
+    return F.kl_div(student_logits, tea_logits, reduction='batchmean', log_target=True)
+
+
+# _kd_kl_div, or its compiled version under --compile-kd-loss
+_KD_KL_DIV = None
+
+
+def _get_kd_kl_div(args):
+    """ Bind _KD_KL_DIV on first use """
+    global _KD_KL_DIV
+    if _KD_KL_DIV is None:
+        _KD_KL_DIV = _kd_kl_div
+        if args.compile_kd_loss:
+            # Sequence length changes with curriculum learning
+            _KD_KL_DIV = torch.compile(_kd_kl_div, dynamic=True)
+    return _KD_KL_DIV
+
 def calculate_mos_loss(args, stu_output, teacher_model, tokens, position_ids, attention_mask):
     mos_loss = 0
     alpha = args.kd_alpha_ce
@@ -426,10 +581,7 @@ def calculate_mos_loss(args, stu_output, teacher_model, tokens, position_ids, at
             tea_output, tea_other_losses = teacher_model(tokens, position_ids, attention_mask)
             assert stu_output.size() == tea_output.size(), 'teacher and student output should match in size. Student: {}, Teacher: {}, CL seq length {}'.format(stu_output.size(), tea_output.size(), args.curriculum_seqlen)
 
-        student_logits = F.log_softmax(stu_output / kd_temp, dim=2)
-        tea_logits = F.softmax(tea_output / kd_temp, dim=2) # The target logits is expected to be probabilities. If we use log_softmax, then we need to set target_log to true when initializing the KLDivLoss.
-
-        mos_loss = kd_temp * kd_temp * nn.KLDivLoss(reduction='batchmean')(student_logits, tea_logits)
+        mos_loss = kd_temp * kd_temp * _get_kd_kl_div(args)(stu_output, tea_output, kd_temp)
 
         mos_loss = mos_loss.div(args.seq_length) * beta
     return mos_loss
@@ -464,11 +616,12 @@ def forward_step(data_iterator, model):
     if args.curriculum_learning_legacy and args.curriculum_seqlen < args.seq_length:
         loss_mask = loss_mask[:, :args.curriculum_seqlen].contiguous()
 
-    moe_losses = []
-    for moe_loss in other_losses:
-        if moe_loss is not None:
-            moe_losses.append(moe_loss)
-    moe_loss = sum(moe_losses) * args.moe_loss_coeff
+    # Every transformer layer returns a MoE loss tensor (zero for dense layers)
+    if other_losses:
+        # Single reduction kernel instead of a chain of scalar adds
+        moe_loss = torch.stack(other_losses).sum().mul_(args.moe_loss_coeff)
+    else:
+        moe_loss = 0.0
 
     mos_loss = 0
     if args.mos or args.kd:
@@ -537,5 +690,7 @@ if __name__ == "__main__":
              model_provider,
              ModelType.encoder_or_decoder,
              forward_step,
-             args_defaults={'tokenizer_type': 'GPT2BPETokenizer'},
+             args_defaults={'tokenizer_type': 'GPT2BPETokenizer',
+                            # Fixed shapes, let cuDNN autotune and use TF32
+                            'deterministic': False},
              data_post_process=data_post_process)
@@ -0,0 +1,45 @@
+# Copyright (c) 2023, NVIDIA CORPORATION. All rights reserved.
+
+
+import math
+
+import pytest
+
+import torch
+
+from megatron.model.transformer import FlashSelfAttentionTorch
+
+
+def _reference_attention(q, k, v, softmax_scale):
+    # [b, s, h, d] -> [b, h, s, d]
+    q, k, v = [x.transpose(1, 2).float() for x in (q, k, v)]
+    scores = torch.matmul(q, k.transpose(-2, -1)) * softmax_scale
+    sq, sk = scores.shape[-2:]
+    mask = torch.ones((sq, sk), dtype=torch.bool, device=scores.device).triu_(1)
+    probs = torch.softmax(scores.masked_fill(mask, float('-inf')), dim=-1)
+    return torch.matmul(probs, v).transpose(1, 2)
+
+
+class TestFlashSelfAttentionTorch:
+
+    @pytest.mark.parametrize("softmax_scale", [None, 0.5])
+    def test_gpu_forward(self, softmax_scale):
+        attention = FlashSelfAttentionTorch(causal=True, softmax_scale=softmax_scale)
+        attention.eval()
+
+        micro_batch_size, sequence_length, num_heads, head_dim = 2, 32, 4, 16
+        q, k, v = [
+            torch.randn(
+                (micro_batch_size, sequence_length, num_heads, head_dim),
+                dtype=torch.float16, device='cuda')
+            for _ in range(3)
+        ]
+
+        output = attention(q, k, v)
+
+        scale = softmax_scale if softmax_scale is not None else 1.0 / math.sqrt(head_dim)
+        expected = _reference_attention(q, k, v, scale)
+
+        assert output.shape == q.shape
+        assert output.dtype == torch.float16
+        assert torch.allclose(output.float(), expected, atol=2e-3, rtol=2e-3)
@@ -1,3 +1,5 @@
+from megatron.core import parallel_state
+from megatron.core.tensor_parallel import data
 from megatron.core.tensor_parallel.data import broadcast_data
 import torch
 from tests.unit_tests.test_utilities import Utils
@@ -18,4 +20,28 @@ def test_broadcast_data():
     actual_output = broadcast_data([0,1],input_data, dtype)
     assert(torch.equal(actual_output[0], input_data[0]))
     assert(torch.equal(actual_output[1], input_data[1]))
-    Utils.destroy_model_parallel()
\ No newline at end of file
+    Utils.destroy_model_parallel()
+
+
+def test_broadcast_data_from_host():
+    Utils.initialize_model_parallel(2,4)
+    dtype = torch.int32
+    # The staging buffers are module globals, start from an empty cache
+    data._PINNED_BUFFERS.clear()
+    # The second call outgrows the pinned staging buffer and reallocates it,
+    # the third one reuses a slice of the larger buffer.
+    for size in (8, 16, 8):
+        numel = size * size
+        input_data = {
+            0 : torch.arange(numel, dtype=dtype).view(size,size),
+            1 : torch.arange(numel, 2 * numel, dtype=dtype).view(size,size)
+            }
+        actual_output = broadcast_data([0,1],input_data, dtype)
+        assert(torch.equal(actual_output[0].cpu(), input_data[0]))
+        assert(torch.equal(actual_output[1].cpu(), input_data[1]))
+    # Only the source rank stages the data through the pinned buffer
+    if parallel_state.get_tensor_model_parallel_rank() == 0:
+        assert(data._PINNED_BUFFERS[dtype].numel() == 2 * 16 * 16)
+    else:
+        assert(dtype not in data._PINNED_BUFFERS)
+    Utils.destroy_model_parallel()